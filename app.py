@@ -1,9 +1,17 @@
+import asyncio
+import json
+import queue
+import threading
+from datetime import date, timedelta
+
 import streamlit as st
-import plotly.express as px
-import pandas as pd
-import requests
-from fpdf import FPDF
-from io import BytesIO
+import numpy as np
+import httpx
+
+# plotly, pandas, yfinance and fpdf are imported lazily inside the cached
+# helpers that need them: the script re-executes on every interaction, and
+# keeping them out of module scope keeps plain reruns (login, widget edits)
+# from paying their import cost.
 
 # ---------------------- 1.  API / Secrets -----------------------
 api_key   = st.secrets["openrouter_api_key"]
@@ -22,14 +30,195 @@ def login_section() -> None:
         st.session_state["user"] = {"email": email}
         st.success(f"✅ Logged in as {email}")
 
+def sip_monthly(target_corpus, monthly_rate, months):
+    """Monthly SIP payment needed to reach ``target_corpus``.
+
+    Written in NumPy ufuncs so scalars and whole (rate × duration)
+    scenario grids evaluate in a single vectorized pass.
+    """
+    return target_corpus * monthly_rate / (np.power(1.0 + monthly_rate, months) - 1.0)
+
+CAGR_TICKERS = {
+    "Equity": "NIFTYBEES.NS",
+    "Debt":   "LIQUIDBEES.NS",
+    "Gold":   "GOLDBEES.NS",
+}
+
+# Used when Yahoo Finance is unreachable or returns no data.
+FALLBACK_CAGR_5Y = {"Equity": 14.7, "Debt": 6.0, "Gold": 10.6}
+
+@st.cache_data(show_spinner=False)
+def build_cagr_df(returns: dict[str, float | None]) -> "pd.DataFrame":
+    """CAGR table for display, with static fallbacks for missing tickers."""
+    import pandas as pd
+
+    return pd.DataFrame({
+        "Asset":      list(returns),
+        "5 Year (%)": [v if v is not None else FALLBACK_CAGR_5Y[a]
+                       for a, v in returns.items()],
+    })
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_cagrs(tickers: tuple[str, ...], years: int = 5) -> dict[str, float | None]:
+    """Download all tickers in one threaded request and return CAGR per ticker."""
+    import pandas as pd
+    import yfinance as yf
+
+    end   = date.today()
+    start = end - timedelta(days=365 * years)
+    try:
+        # CAGR only needs the endpoints, so monthly bars suffice and the
+        # payload shrinks ~20x versus daily history.
+        data = yf.download(list(tickers), start=start, end=end,
+                           interval="1mo", auto_adjust=True,
+                           group_by="ticker", threads=True, progress=False)
+    except Exception:
+        return {t: None for t in tickers}
+    if data.empty:
+        return {t: None for t in tickers}
+    if isinstance(data.columns, pd.MultiIndex):
+        closes = data.xs("Close", axis=1, level=1)
+    else:  # yfinance flattens columns when given a single ticker
+        closes = data[["Close"]].set_axis(list(tickers), axis=1)
+    # bfill/ffill pick each ticker's first and last valid price in one pass.
+    first = closes.bfill().iloc[0]
+    last  = closes.ffill().iloc[-1]
+    cagr  = ((last / first) ** (1 / years) - 1) * 100
+    return {t: round(float(cagr[t]), 2) if t in cagr and pd.notna(cagr[t]) else None
+            for t in tickers}
+
+_ALLOCATIONS = {
+    "Low":    {"Equity": 30, "Debt": 60, "Gold": 10},
+    "Medium": {"Equity": 50, "Debt": 40, "Gold": 10},
+    "High":   {"Equity": 70, "Debt": 20, "Gold": 10},
+}
+
 def get_portfolio_allocation(risk: str) -> dict:
-    return {
-        "Low":    {"Equity": 30, "Debt": 60, "Gold": 10},
-        "Medium": {"Equity": 50, "Debt": 40, "Gold": 10},
-        "High":   {"Equity": 70, "Debt": 20, "Gold": 10},
-    }[risk]
+    # Callers only read the allocation, so no defensive copy is needed.
+    return _ALLOCATIONS[risk]
+
+@st.cache_resource
+def allocation_pie(risk: str):
+    """Donut chart for a risk level — built once, reused on every rerun."""
+    import plotly.express as px
+
+    allocation = get_portfolio_allocation(risk)
+    return px.pie(
+        names=list(allocation.keys()),
+        values=list(allocation.values()),
+        title="Your Investment Allocation",
+        hole=0.4,
+        color_discrete_sequence=px.colors.sequential.RdBu
+    )
+
+@st.cache_resource
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """One long-lived loop so pooled connections survive Streamlit reruns."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def _http_client() -> httpx.AsyncClient:
+    # http2/limits must live on the transport: client-level kwargs are
+    # ignored as soon as a custom transport is passed.
+    return httpx.AsyncClient(
+        timeout=30,
+        headers=headers,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+        ),
+    )
+
+_STREAM_END = object()
+
+def _stream_chat(payload: dict):
+    """Yield content deltas from an SSE chat-completions stream.
+
+    The coroutine runs on the shared background loop (where the pooled
+    client lives) and hands chunks to this generator through a queue, so
+    st.write_stream can render them from the script thread as they arrive.
+    """
+    chunks: queue.Queue = queue.Queue()
+
+    async def _pump():
+        try:
+            async with _http_client().stream(
+                "POST", f"{api_base}/chat/completions", json=payload
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0]["delta"]
+                    if delta.get("content"):
+                        chunks.put(delta["content"])
+        finally:
+            chunks.put(_STREAM_END)
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), _event_loop())
+    while (chunk := chunks.get()) is not _STREAM_END:
+        yield chunk
+    future.result(timeout=5)  # surface any transport error
+
+# Reworded goals ("retire early" vs "early retirement") miss the
+# exact-match cache even though the advice is the same; above this cosine
+# similarity a previous answer is reused instead of calling the LLM.
+SEMANTIC_SIM_THRESHOLD = 0.92
+
+@st.cache_resource
+def _embedder():
+    """Local sentence encoder for the semantic cache; None if unavailable."""
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer("all-MiniLM-L6-v2")
+    except Exception:
+        return None
+
+def _semantic_lookup(goal: str, context: tuple):
+    """Return (goal embedding, cached answer or None).
+
+    Only the goal text is embedded; ``context`` (age, risk, allocation)
+    must match exactly. Embedding the whole prompt would let near-identical
+    sentences that differ only in the percentages score above the
+    threshold and serve a narrative for the wrong allocation.
+    """
+    embedder = _embedder()
+    if embedder is None:
+        return None, None
+    vec = embedder.encode(goal, normalize_embeddings=True)
+    matches = [(v, answer) for ctx, v, answer in st.session_state.get("sem_cache", [])
+               if ctx == context]
+    if matches:
+        sims = np.stack([v for v, _ in matches]) @ vec
+        best = int(np.argmax(sims))
+        if sims[best] > SEMANTIC_SIM_THRESHOLD:
+            return vec, matches[best][1]
+    return vec, None
 
 def explain_portfolio(allocation: dict, age: int, risk: str, goal: str) -> str:
+    """Render the advisor narrative and return its full text.
+
+    Cached answers (exact-match, then semantic) display at once; a cache
+    miss streams the reply token-by-token via st.write_stream, so the user
+    sees output after the first token instead of after the last.
+    """
+    # Without a goal the model can only answer generically — skip the
+    # network call and template the answer locally.
+    if not goal.strip():
+        fallback = (
+            f"Based on {risk} risk tolerance and age {age}, allocate "
+            f"Equity {allocation['Equity']}%, Debt {allocation['Debt']}% "
+            f"and Gold {allocation['Gold']}%. "
+            f"Please set a specific goal for tailored advice."
+        )
+        st.write(fallback)
+        return fallback
     prompt = (
         f"Act like a professional financial advisor. "
         f"Explain this portfolio allocation for a {age}-year-old with {risk} risk tolerance. "
@@ -37,68 +226,106 @@ def explain_portfolio(allocation: dict, age: int, risk: str, goal: str) -> str:
         f"Allocation: Equity {allocation['Equity']}%, "
         f"Debt {allocation['Debt']}%, Gold {allocation['Gold']}%."
     )
+    exact_cache = st.session_state.setdefault("llm_cache", {})
+    if prompt in exact_cache:
+        st.write(exact_cache[prompt])
+        return exact_cache[prompt]
+    context = (age, risk, tuple(sorted(allocation.items())))
+    vec, cached = _semantic_lookup(goal, context)
+    if cached is not None:
+        st.write(cached)
+        return cached
     payload = {
         "model": model_name,
         "messages": [
-            {"role": "system", "content": "You are a helpful financial advisor."},
+            {"role": "system", "content": (
+                "You are a helpful financial advisor. Structure your reply as "
+                "three markdown sections with exactly these headings: "
+                "'### 📘 Advisor's Explanation', '### ⚖️ Risk Commentary' "
+                "and '### 🎯 Goal Feasibility'."
+            )},
             {"role": "user",   "content": prompt}
-        ]
+        ],
+        "stream": True
     }
     try:
-        resp = requests.post(f"{api_base}/chat/completions",
-                             headers=headers, json=payload, timeout=30)
-        resp.raise_for_status()
-        return resp.json()["choices"][0]["message"]["content"]
+        text = st.write_stream(_stream_chat(payload))
     except Exception as e:
         st.error(f"🔌 LLM error: {e}")
         return "Sorry, I couldn’t fetch the explanation right now."
+    exact_cache[prompt] = text
+    if vec is not None:
+        st.session_state.setdefault("sem_cache", []).append((context, vec, text))
+    return text
 
 # ---------------------- 3.  PDF Generator -----------------------
+# FPDF's built-in fonts only cover latin-1; transliterate what has an
+# obvious ASCII form and drop anything else before layout.
+_PDF_CHAR_MAP = str.maketrans({
+    "₹": "Rs. ",
+    "’": "'", "‘": "'",
+    "“": '"', "”": '"',
+    "–": "-", "—": "-",
+})
+
+def _latin1(text: str) -> str:
+    return (text.translate(_PDF_CHAR_MAP)
+                .encode("latin-1", "ignore")
+                .decode("latin-1"))
+
+def _markdown_to_pdf_text(markdown: str) -> str:
+    """Flatten the streamed advisor markdown for PDF layout.
+
+    Heading lines like '### 📘 Advisor's Explanation' become plain
+    'Advisor's Explanation' — both the markers and the emoji (which
+    latin-1 cannot carry) are removed, not just the '### ' prefix.
+    """
+    lines = []
+    for line in markdown.splitlines():
+        if line.lstrip().startswith("#"):
+            line = _latin1(line.lstrip("# ")).strip()
+        lines.append(line)
+    return "\n".join(lines)
+
+@st.cache_data(show_spinner=False, max_entries=16)
 def generate_pdf_bytes(name: str, age: int, income: int, risk: str,
                        goal: str, allocation: dict, explanation: str,
-                       mip_info: dict | None = None) -> BytesIO:
+                       mip_info: dict | None = None) -> bytes:
+    from fpdf import FPDF
+
+    # Each section is one (heading, body) pair rendered with a single
+    # multi_cell, instead of a cell/set_font call per line.
+    sections = [
+        ("", (
+            f"Name: {name}    Age: {age}    Monthly Income: ₹{income:,}\n"
+            f"Risk Tolerance: {risk}    Goal: {goal}"
+        )),
+        ("Portfolio Allocation:",
+         "\n".join(f"- {asset}: {pct}%" for asset, pct in allocation.items())),
+        ("Advisor’s Explanation:", explanation),
+    ]
+    if mip_info:
+        sections.append(("Monthly Investment Plan:", (
+            f"Target Corpus: ₹{mip_info['future_value']:,}\n"
+            f"Invest ₹{mip_info['monthly']:,} per month "
+            f"for {mip_info['years']} years at "
+            f"{mip_info['rate']}% expected return."
+        )))
+
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", "B", 16)
     pdf.cell(0, 10, "Wealth Advisor Report", ln=True, align="C")
-    pdf.set_font("Arial", size=12)
-
-    # Profile Info
-    pdf.ln(6)
-    pdf.multi_cell(0, 8, f"Name: {name}    Age: {age}    Monthly Income: ₹{income:,}")
-    pdf.multi_cell(0, 8, f"Risk Tolerance: {risk}    Goal: {goal}")
-
-    # Allocation
-    pdf.ln(4)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, "Portfolio Allocation:", ln=True)
-    pdf.set_font("Arial", size=12)
-    for asset, pct in allocation.items():
-        pdf.cell(0, 8, f"- {asset}: {pct}%", ln=True)
-
-    # Explanation
-    pdf.ln(4)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 8, "Advisor’s Explanation:", ln=True)
-    pdf.set_font("Arial", size=12)
-    pdf.multi_cell(0, 8, explanation)
-
-    # Monthly Investment Plan
-    if mip_info:
+    for heading, body in sections:
         pdf.ln(4)
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "Monthly Investment Plan:", ln=True)
+        if heading:
+            pdf.set_font("Arial", "B", 12)
+            pdf.cell(0, 8, _latin1(heading), ln=True)
         pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 8, (
-            f"Target Corpus: ₹{mip_info['future_value']:,}\n"
-            f"Invest ₹{mip_info['monthly']:,} per month "
-            f"for {mip_info['years']} years at "
-            f"{mip_info['rate']}% expected return."
-        ))
+        pdf.multi_cell(0, 8, _latin1(body))
 
     # ✅ Fixed: Output PDF as bytes
-    pdf_bytes = pdf.output(dest="S").encode("latin-1")
-    return BytesIO(pdf_bytes)
+    return pdf.output(dest="S").encode("latin-1")
 
 # ---------------------- 4.  Streamlit App -----------------------
 st.set_page_config(page_title="GenAI Wealth Advisor", page_icon="💼")
@@ -109,85 +336,98 @@ login_section()
 if "user" not in st.session_state:
     st.stop()
 
-# Profile inputs
+# Profile inputs — batched in a form so slider nudges don't rerun the
+# heavy path; the script only recomputes on submit.
 st.subheader("👤 Profile Details")
-age           = st.slider("Age", 18, 70, 30)
-income        = st.number_input("Monthly Income (₹)", value=50_000, step=1_000)
-risk_tolerance = st.selectbox("Risk Tolerance", ["Low", "Medium", "High"])
-goal          = st.text_input("Primary Goal (e.g., retirement, house)")
+with st.form("portfolio_inputs"):
+    age            = st.slider("Age", 18, 70, 30)
+    income         = st.number_input("Monthly Income (₹)", value=50_000, step=1_000)
+    risk_tolerance = st.selectbox("Risk Tolerance", ["Low", "Medium", "High"])
+    goal           = st.text_input("Primary Goal (e.g., retirement, house)")
+
+    st.subheader("📈 Monthly Investment Plan")
+    rate          = st.slider("Expected Annual Return (%)", 6.0, 15.0, 12.0)
+    years         = st.slider("Investment Duration (Years)", 1, 40, 10)
+    target_corpus = st.number_input("Target Corpus (₹)", value=4_500_000, step=50_000)
+
+    submitted = st.form_submit_button("🔍 Generate Portfolio")
 
 # ----------------------------------------------------------------
-# ▶ Generate Portfolio Button
+# ▶ Generate Portfolio (heavy work only on form submit)
 # ----------------------------------------------------------------
-if st.button("🔍 Generate Portfolio"):
+if submitted:
     allocation = get_portfolio_allocation(risk_tolerance)
+    monthly_rate = rate / 100 / 12
+    monthly = int(round(float(sip_monthly(target_corpus, monthly_rate, years * 12))))
+    st.session_state["result"] = {
+        "age":        age,
+        "income":     income,
+        "risk":       risk_tolerance,
+        "goal":       goal,
+        "allocation": allocation,
+        "mip_info": {
+            "monthly":     monthly,
+            "years":       years,
+            "rate":        rate,
+            "future_value": target_corpus
+        },
+    }
 
-    # Donut Chart
-    fig = px.pie(
-        names=list(allocation.keys()),
-        values=list(allocation.values()),
-        title="Your Investment Allocation",
-        hole=0.4,
-        color_discrete_sequence=px.colors.sequential.RdBu
-    )
-    st.plotly_chart(fig, use_container_width=True)
+result = st.session_state.get("result")
+if result:
+    mip_info = result["mip_info"]
 
-    # LLM Explanation
-    explanation = explain_portfolio(allocation, age, risk_tolerance, goal)
-    st.markdown("### 📘 Advisor's Explanation")
-    st.write(explanation)
+    # Donut Chart (one cached Figure per risk level)
+    st.plotly_chart(allocation_pie(result["risk"]), use_container_width=True)
 
-    # ---------------- Monthly Investment Plan -------------------
-    st.subheader("📈 Monthly Investment Plan")
-    rate   = st.slider("Expected Annual Return (%)", 6.0, 15.0, 12.0)
-    years  = st.slider("Investment Duration (Years)", 1, 40, 10)
-    months = years * 12
-    monthly_rate = rate / 100 / 12
+    # LLM narrative — streams on first generation, instant from cache after
+    explanation = explain_portfolio(
+        result["allocation"], result["age"], result["risk"], result["goal"]
+    )
 
-    target_corpus = st.number_input("Target Corpus (₹)", value=4_500_000, step=50_000)
-    monthly = target_corpus * monthly_rate / ((1 + monthly_rate)**months - 1)
-    monthly = int(round(monthly, 0))
     st.success(
-        f"To reach ₹{target_corpus:,} in {years} years at {rate}% return, "
-        f"invest **₹{monthly:,}/month**."
+        f"To reach ₹{mip_info['future_value']:,} in {mip_info['years']} years "
+        f"at {mip_info['rate']}% return, invest **₹{mip_info['monthly']:,}/month**."
     )
 
-    mip_info = {
-        "monthly":     monthly,
-        "years":       years,
-        "rate":        rate,
-        "future_value": target_corpus
-    }
-
     # ---------------- CAGR Table -----------------------
     st.subheader("📉 CAGR Estimates")
-    cagr_data = {
-        "Asset":        ["Equity", "Debt", "Gold"],
-        "1 Year (%)":   [22.5, 6.2, 12.1],
-        "3 Year (%)":   [18.3, 5.9, 11.4],
-        "5 Year (%)":   [14.7, 6.0, 10.6]
-    }
-    df_cagr = pd.DataFrame(cagr_data)
-    st.dataframe(df_cagr, use_container_width=True)
+    cagrs = fetch_cagrs(tuple(CAGR_TICKERS.values()))
+    returns = {asset: cagrs[ticker] for asset, ticker in CAGR_TICKERS.items()}
+    cagr_arr = np.array([np.nan if v is None else v for v in returns.values()],
+                        dtype=np.float64)
+    n_valid = cagr_arr.size - int(np.isnan(cagr_arr).sum())
+    if not n_valid:
+        st.warning("⚠️ Live market data unavailable — showing historical estimates.")
+    elif n_valid < cagr_arr.size:
+        st.warning("⚠️ Some tickers unavailable — using historical estimates for them.")
+    df_cagr = build_cagr_df(returns)
+    st.table(df_cagr)
 
-    avg_5yr = round(df_cagr["5 Year (%)"].mean(), 2)
+    # Average the displayed column (live values plus any fallbacks) so the
+    # summary always matches the table above it.
+    avg_5yr = round(float(df_cagr["5 Year (%)"].mean()), 2)
     st.info(f"📊 Average 5-Year CAGR across assets: **{avg_5yr}%**")
 
-    # ---------------- PDF Generation ---------------------------
+    # ---------------- PDF Download ---------------------------
     st.markdown("---")
-    if st.button("📄 Generate PDF Report"):
+    try:
         pdf_bytes = generate_pdf_bytes(
             name="User",
-            age=age,
-            income=income,
-            risk=risk_tolerance,
-            goal=goal,
-            allocation=allocation,
-            explanation=explanation,
+            age=result["age"],
+            income=result["income"],
+            risk=result["risk"],
+            goal=result["goal"],
+            allocation=result["allocation"],
+            explanation=_markdown_to_pdf_text(explanation),
             mip_info=mip_info
         )
+    except Exception as e:
+        # A broken report shouldn't take the feedback section down with it.
+        st.warning(f"⚠️ PDF report unavailable: {e}")
+    else:
         st.download_button(
-            "📥 Download PDF",
+            "📥 Download PDF Report",
             data=pdf_bytes,
             file_name="Wealth_Report.pdf",
             mime="application/pdf"